@@ -1,87 +1,250 @@
 import os
+import sys
 import json
 import boto3
-import uuid
+from botocore.config import Config
 import time
-import shutil
+import uuid
 from datetime import datetime, timezone, timedelta
 from google.cloud import storage
-import zipfile
-from typing import Dict, Any, List
-from tenacity import retry, stop_after_attempt, wait_exponential
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List
+
+# Number of workers looking up, transferring and queueing files at once
+TRANSFER_CONCURRENCY = int(os.environ.get('TRANSFER_CONCURRENCY', '16'))
+
+# Clients are created once per container and reused across warm invocations,
+# keeping their connections alive between calls; every worker may hold one
+_BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    max_pool_connections=TRANSFER_CONCURRENCY
+)
+_SECRETS = boto3.client('secretsmanager', config=_BOTO_CONFIG)
+_STORAGE_CLIENT = None
+_STORAGE_CLIENT_EXPIRES = 0.0
+
+# When set, scheduled runs only list files and queue one SQS message per file;
+# invocations triggered by that queue do the transfers
+TRANSFER_QUEUE_URL = os.environ.get('TRANSFER_QUEUE_URL')
+_SQS = boto3.client('sqs', config=_BOTO_CONFIG) if TRANSFER_QUEUE_URL else None
+SQS_BATCH_SIZE = 10
+
+# Queued files are marked under this directory of the destination so later
+# runs don't queue them again while they wait or transfer; markers older than
+# the TTL are ignored so files whose transfer never completed are queued again
+QUEUED_MARKER_DIR = '.queued'
+QUEUED_MARKER_TTL_SECONDS = int(os.environ.get('QUEUED_MARKER_TTL_SECONDS', '3600'))
+
+# Refresh the cached secret periodically so rotated credentials are picked up
+STORAGE_CLIENT_TTL_SECONDS = 30 * 60
+
+# Only request the blob attributes the handler reads when listing
+LIST_BLOBS_FIELDS = "items(name,size),nextPageToken"
+
+# Let GCS return only zip files when listing
+ZIP_MATCH_GLOB = "**/*.zip"
+
+# Worker pool for blob lookups and transfers, reused across warm invocations
+_POOL = ThreadPoolExecutor(max_workers=TRANSFER_CONCURRENCY)
+
+# Destination directories already created by this container, so warm
+# invocations skip repeated mkdir round-trips to EFS
+_MADE_DIRS = set()
+
+# GCS hands downloads over in 8 KiB chunks; buffer them so each write to EFS
+# carries 1 MiB
+EFS_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Downloads are attempted this many times, waiting 4-10 seconds in between
+DOWNLOAD_ATTEMPTS = 3
+
+# Per-file metrics are queued here and sent by flush_file_metrics
+_PENDING_FILE_METRICS = []
+
+# Name and unit of each metric recorded per transfer, in the order
+# track_file_transfer supplies their values
+TRANSFER_METRICS = (
+    ('TransferDuration', 'Seconds'),
+    ('FileSize', 'Bytes'),
+    ('TransferSuccess', 'Count')
+)
+SKIPPED_EXISTING_METRIC = {'MetricName': 'SkippedExisting', 'Value': 1, 'Unit': 'Count'}
+
+# Outcomes returned by transfer_single_file
+TRANSFERRED = 'transferred'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+# Metrics are written to stdout in CloudWatch Embedded Metric Format, which
+# allows at most 100 values per metric in one record
+EMF_MAX_VALUES = 100
 
 def get_current_path():
     """Get current UTC time folder path: yyyy/MM/DD/HH"""
     now = datetime.now(timezone.utc)
     return now.strftime("%Y/%m/%d/%H")
 
-def get_hour_path(hours_ago):
-    """Get UTC time folder path for X hours ago: yyyy/MM/DD/HH"""
-    now = datetime.now(timezone.utc) - timedelta(hours=hours_ago)
-    return now.strftime("%Y/%m/%d/%H")
+def get_hour_path(hours_ago, now=None):
+    """Get UTC time folder path for X hours before now: yyyy/MM/DD/HH"""
+    then = (now or datetime.now(timezone.utc)) - timedelta(hours=hours_ago)
+    return then.strftime("%Y/%m/%d/%H")
 
 def get_storage_client():
-    """Create a Google Cloud Storage client using credentials from AWS Secrets Manager"""
+    """Get the cached Google Cloud Storage client, rebuilding it once the cache expires"""
+    global _STORAGE_CLIENT, _STORAGE_CLIENT_EXPIRES
+    if _STORAGE_CLIENT is not None and time.monotonic() < _STORAGE_CLIENT_EXPIRES:
+        return _STORAGE_CLIENT
+
     try:
         # Get credentials from AWS Secrets Manager
-        secret_client = boto3.client('secretsmanager')
-        secret_response = secret_client.get_secret_value(
+        secret_response = _SECRETS.get_secret_value(
             SecretId=os.environ['GOOGLE_CREDS_SECRET_NAME']
         )
         credentials_dict = json.loads(secret_response['SecretString'])
         
         # Create storage client directly from service account info
-        return storage.Client.from_service_account_info(credentials_dict)
+        client = storage.Client.from_service_account_info(credentials_dict)
+        
+        # The default pool keeps 10 connections; give every worker its own
+        adapter = HTTPAdapter(pool_connections=TRANSFER_CONCURRENCY, pool_maxsize=TRANSFER_CONCURRENCY)
+        client._http.mount('https://', adapter)
+        
+        _STORAGE_CLIENT = client
+        _STORAGE_CLIENT_EXPIRES = time.monotonic() + STORAGE_CLIENT_TTL_SECONDS
+        return _STORAGE_CLIENT
     except Exception as e:
         print(f"Error setting up Google Storage client: {str(e)}")
         raise
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    reraise=True
-)
-def download_from_gcs_with_retry(blob):
-    """Download from Google Cloud Storage with retry mechanism"""
+def list_zip_blobs(gcs_bucket, start_offset, end_offset, on_page=None):
+    """List the zip files named from start_offset up to (not including) end_offset,
+    passing each page to on_page as it arrives"""
+    print(f"Listing files from {start_offset} up to {end_offset}")
+    iterator = gcs_bucket.list_blobs(
+        start_offset=start_offset,
+        end_offset=end_offset,
+        match_glob=ZIP_MATCH_GLOB,
+        fields=LIST_BLOBS_FIELDS
+    )
+    zip_blobs = []
+    for page in iterator.pages:
+        page_blobs = list(page)
+        if on_page is not None:
+            on_page(page_blobs)
+        zip_blobs.extend(page_blobs)
+    print(f"Found {len(zip_blobs)} zip files")
+    return zip_blobs
+
+def get_named_zip_blobs(gcs_bucket, blob_names):
+    """Fetch the zip files named in the triggering event, skipping missing ones"""
+    zip_names = [name for name in blob_names if name.endswith('.zip')]
+    return [blob for blob in _POOL.map(gcs_bucket.get_blob, zip_names) if blob is not None]
+
+def release_page_cache(fd, name):
+    """Write a file's data back and drop its pages from the page cache, which
+    counts against the function's memory; failures are only logged"""
     try:
-        return blob.download_as_bytes()
-    except Exception as e:
-        print(f"Download attempt failed for {blob.name}: {str(e)}")
-        raise
+        # DONTNEED skips dirty pages, so they must be written back first
+        os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        print(f"Could not release cached pages for {name}: {str(e)}")
 
-def put_metrics(cloudwatch, namespace: str, metrics_data: List[Dict]):
-    """Helper function to send metrics to CloudWatch"""
+def download_from_gcs_with_retry(blob, destination_path):
+    """Stream a file from Google Cloud Storage to disk with retry mechanism"""
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        # Each attempt writes its own temporary file and only renames it over
+        # the destination once complete, so a concurrent transfer of the same
+        # file can never truncate or interleave with this one
+        part_path = f"{destination_path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(part_path, 'wb', buffering=EFS_WRITE_BUFFER_SIZE) as f:
+                blob.download_to_file(f, raw_download=True, checksum=None)
+                f.flush()
+                release_page_cache(f.fileno(), blob.name)
+            os.replace(part_path, destination_path)
+            return
+        except FileNotFoundError:
+            # The cached destination directory was removed; nothing remote
+            # failed, so recreate it and retry without backing off
+            print(f"Destination directory missing for {blob.name}, recreating it")
+            if attempt == DOWNLOAD_ATTEMPTS:
+                raise
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            continue
+        except Exception as e:
+            print(f"Download attempt failed for {blob.name}: {str(e)}")
+            if attempt == DOWNLOAD_ATTEMPTS:
+                raise
+        finally:
+            # Clean up this attempt's temporary file unless it was renamed into place
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+        # Exponential backoff between attempts, bounded to 4-10 seconds
+        time.sleep(min(10, max(4, 2 ** (attempt - 1))))
+
+def put_metrics(namespace: str, metrics_data: List[Dict]):
+    """Helper function to emit metrics to CloudWatch as Embedded Metric Format logs"""
     try:
-        cloudwatch.put_metric_data(Namespace=namespace, MetricData=metrics_data)
+        # Metrics sharing a dimension set go into the same EMF record
+        groups = {}
+        for metric in metrics_data:
+            dimensions = tuple((d['Name'], d['Value']) for d in metric.get('Dimensions', []))
+            units, values = groups.setdefault(dimensions, ({}, {}))
+            units[metric['MetricName']] = metric['Unit']
+            values.setdefault(metric['MetricName'], []).append(metric['Value'])
+
+        timestamp = int(time.time() * 1000)
+        for dimensions, (units, values) in groups.items():
+            longest = max(len(v) for v in values.values())
+            for start in range(0, longest, EMF_MAX_VALUES):
+                chunk = {
+                    name: v[start:start + EMF_MAX_VALUES]
+                    for name, v in values.items() if len(v) > start
+                }
+                record = {
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': namespace,
+                            'Dimensions': [[name for name, _ in dimensions]],
+                            'Metrics': [{'Name': name, 'Unit': units[name]} for name in chunk]
+                        }]
+                    }
+                }
+                record.update(dimensions)
+                record.update({name: v[0] if len(v) == 1 else v for name, v in chunk.items()})
+                # One write per record; print() writes the newline separately,
+                # so other threads' output could split the line
+                sys.stdout.write(json.dumps(record) + '\n')
     except Exception as e:
         print(f"Error sending metrics: {str(e)}")
 
-def track_file_transfer(cloudwatch, file_name: str, file_size: int, duration: float, success: bool):
-    """Track metrics for file transfer"""
-    metrics = [
-        {
-            'MetricName': 'TransferDuration',
-            'Value': duration,
-            'Unit': 'Seconds',
-            'Dimensions': [{'Name': 'FileName', 'Value': file_name}]
-        },
-        {
-            'MetricName': 'FileSize',
-            'Value': file_size,
-            'Unit': 'Bytes',
-            'Dimensions': [{'Name': 'FileName', 'Value': file_name}]
-        },
-        {
-            'MetricName': 'TransferSuccess',
-            'Value': 1 if success else 0,
-            'Unit': 'Count',
-            'Dimensions': [{'Name': 'FileName', 'Value': file_name}]
-        }
-    ]
+def track_file_transfer(file_size: int, duration: float, success: bool, skipped: bool = False):
+    """Queue metrics for file transfer (file names go to the logs, not metric dimensions)"""
+    if skipped:
+        # Skips move no data, so they would only skew duration and size stats
+        _PENDING_FILE_METRICS.append(SKIPPED_EXISTING_METRIC)
+        return
 
-    put_metrics(cloudwatch, 'MOD/FileTransfer', metrics)
+    values = (duration, file_size, 1 if success else 0)
+    _PENDING_FILE_METRICS.extend(
+        {'MetricName': name, 'Value': value, 'Unit': unit}
+        for (name, unit), value in zip(TRANSFER_METRICS, values)
+    )
 
-def track_batch_processing(cloudwatch, total_files: int, successful_files: int, total_size: int, duration: float):
+def flush_file_metrics():
+    """Send queued per-file metrics to CloudWatch"""
+    global _PENDING_FILE_METRICS
+    metrics, _PENDING_FILE_METRICS = _PENDING_FILE_METRICS, []
+    if metrics:
+        put_metrics('MOD/FileTransfer', metrics)
+
+def track_batch_processing(total_files: int, successful_files: int, total_size: int, duration: float,
+                           skipped_files: int = 0, queued_files: int = 0):
     """Track metrics for batch processing"""
     metrics = [
         {
@@ -94,6 +257,16 @@ def track_batch_processing(cloudwatch, total_files: int, successful_files: int,
             'Value': successful_files,
             'Unit': 'Count'
         },
+        {
+            'MetricName': 'SkippedFiles',
+            'Value': skipped_files,
+            'Unit': 'Count'
+        },
+        {
+            'MetricName': 'QueuedFiles',
+            'Value': queued_files,
+            'Unit': 'Count'
+        },
         {
             'MetricName': 'TotalSize',
             'Value': total_size,
@@ -106,89 +279,203 @@ def track_batch_processing(cloudwatch, total_files: int, successful_files: int,
         }
     ]
 
-    if total_files > 0:
+    # Skipped and queued files weren't transferred by this invocation, so they
+    # don't count towards the rate
+    attempted_files = total_files - skipped_files - queued_files
+    if attempted_files > 0:
         metrics.append({
             'MetricName': 'SuccessRate',
-            'Value': (successful_files / total_files) * 100,
+            'Value': (successful_files / attempted_files) * 100,
             'Unit': 'Percent'
         })
 
-    put_metrics(cloudwatch, 'MOD/BatchProcessing', metrics)
+    put_metrics('MOD/BatchProcessing', metrics)
 
-def transfer_single_file(blob, destination_path, cloudwatch):
-    """Transfer a single file from GCS to destination"""
+def transfer_single_file(blob, destination_path):
+    """Transfer a single file from GCS to destination (its directory must already exist),
+    returning TRANSFERRED, SKIPPED or FAILED"""
     start_time = time.time()
-    temp_dir = os.path.join('/tmp', str(uuid.uuid4()))
-    os.makedirs(temp_dir, exist_ok=True)
     success = False
+    skipped = False
     
     try:
-        # Download file from Google Cloud Storage
-        print(f"Downloading {blob.name} from GCS")
-        file_content = download_from_gcs_with_retry(blob)
-        
-        # Create the destination directory if it doesn't exist
-        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        # Files from the overlapping hours may already have been transferred by
+        # an earlier run; only complete downloads are ever renamed into place
+        if is_transferred(blob, destination_path):
+            success = skipped = True
+            print(f"Skipping {blob.name}, already transferred")
+            return SKIPPED
         
-        # Transfer the file to the destination
+        # Stream the file from Google Cloud Storage to the destination
         print(f"Transferring {blob.name} to {destination_path}")
-        with open(destination_path, 'wb') as f:
-            f.write(file_content)
+        download_from_gcs_with_retry(blob, destination_path)
         
         success = True
         print(f"Successfully transferred {blob.name}")
-        return True
+        return TRANSFERRED
 
     except Exception as e:
         print(f"Error transferring file {blob.name}: {str(e)}")
-        return False
+        return FAILED
         
     finally:
         # Track metrics
         transfer_duration = time.time() - start_time
         track_file_transfer(
-            cloudwatch,
-            blob.name,
             blob.size,
             transfer_duration,
-            success
+            success,
+            skipped
         )
-        
-        # Clean up temporary files
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+
+def get_sqs_messages(event):
+    """Map SQS message IDs to message bodies for queue-triggered events, None otherwise"""
+    records = event.get('Records') or []
+    if not records or records[0].get('eventSource') != 'aws:sqs':
+        return None
+    return {record['messageId']: record['body'] for record in records}
+
+def build_queued_blob(gcs_bucket, body):
+    """Build the blob named in a queued transfer message without fetching its metadata"""
+    message = json.loads(body)
+    blob = gcs_bucket.blob(message['name'])
+    # Carry the same attributes a listing returns
+    blob._set_properties({'name': message['name'], 'size': str(int(message['size']))})
+    return blob
+
+def get_queued_blobs(gcs_bucket, sqs_messages):
+    """Build one blob per file named in queued transfer messages, returning the
+    blobs, the blob name each message refers to and the IDs of malformed messages"""
+    blobs, message_names, bad_message_ids = {}, {}, []
+    for message_id, body in sqs_messages.items():
+        try:
+            blob = build_queued_blob(gcs_bucket, body)
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"Malformed transfer message {message_id}: {str(e)}")
+            bad_message_ids.append(message_id)
+            continue
+        # Redelivered duplicates share one transfer rather than racing on the same path
+        blobs.setdefault(blob.name, blob)
+        message_names[message_id] = blob.name
+    return list(blobs.values()), message_names, bad_message_ids
+
+def is_transferred(blob, destination_path):
+    """Check whether the destination already holds a complete copy of the blob"""
+    try:
+        return os.stat(destination_path).st_size == blob.size
+    except FileNotFoundError:
+        return False
+
+def get_queued_marker_path(destination_base_path, blob_name):
+    """Get the path of the marker recording that a blob is queued for transfer"""
+    return os.path.join(destination_base_path, QUEUED_MARKER_DIR, blob_name)
+
+def needs_queueing(blob, destination_base_path):
+    """Check whether a blob is neither transferred nor recently queued"""
+    if is_transferred(blob, os.path.join(destination_base_path, blob.name)):
+        return False
+    try:
+        marker_age = time.time() - os.stat(get_queued_marker_path(destination_base_path, blob.name)).st_mtime
+        return marker_age > QUEUED_MARKER_TTL_SECONDS
+    except FileNotFoundError:
+        return True
+
+def mark_queued(marker_path):
+    """Create or refresh a queued marker (its directory must already exist)"""
+    with open(marker_path, 'w'):
+        pass
+
+def clear_queued_marker(marker_path):
+    """Remove a queued marker if it exists"""
+    try:
+        os.remove(marker_path)
+    except FileNotFoundError:
+        pass
+
+def queue_transfers(blobs):
+    """Queue one SQS message per blob for worker invocations, returning the blobs queued"""
+    def send_batch(batch):
+        response = _SQS.send_message_batch(
+            QueueUrl=TRANSFER_QUEUE_URL,
+            Entries=[
+                {'Id': str(i), 'MessageBody': json.dumps({'name': blob.name, 'size': blob.size})}
+                for i, blob in enumerate(batch)
+            ]
+        )
+        failed_ids = set()
+        for failure in response.get('Failed', []):
+            print(f"Error queueing {batch[int(failure['Id'])].name}: {failure.get('Message')}")
+            failed_ids.add(failure['Id'])
+        return [blob for i, blob in enumerate(batch) if str(i) not in failed_ids]
+
+    batches = [blobs[i:i + SQS_BATCH_SIZE] for i in range(0, len(blobs), SQS_BATCH_SIZE)]
+    return [blob for queued in _POOL.map(send_batch, batches) for blob in queued]
+
+def make_dirs(paths):
+    """Create the parent directory of each path, once per container"""
+    for directory in {os.path.dirname(path) for path in paths} - _MADE_DIRS:
+        os.makedirs(directory, exist_ok=True)
+        _MADE_DIRS.add(directory)
+
+def submit_transfers(blobs, destination_base_path):
+    """Queue transfers for blobs, creating each destination directory once"""
+    # Destination paths preserve the folder structure
+    destination_paths = [os.path.join(destination_base_path, blob.name) for blob in blobs]
+    make_dirs(destination_paths)
+
+    return [
+        _POOL.submit(transfer_single_file, blob, destination_path)
+        for blob, destination_path in zip(blobs, destination_paths)
+    ]
 
 def lambda_handler(event, context):
     """Main Lambda handler"""
     batch_start_time = time.time()
     destination_base_path = os.environ.get('DESTINATION_PATH', '/mnt/efs')
+    sqs_messages = get_sqs_messages(event)
+    bad_message_ids = []
+    transfers = []
     
     try:
-        # Initialize clients
-        cloudwatch = boto3.client('cloudwatch')
-        
         # Get Google Storage client
         print("Initializing connection to Google Cloud Storage")
         storage_client = get_storage_client()
         
         # Get folder paths for the last 4 hours to ensure we capture all recent files
-        folder_paths = []
-        for i in range(4):
-            folder_paths.append(get_hour_path(i))
+        now = datetime.now(timezone.utc)
+        folder_paths = [get_hour_path(i, now) for i in range(4)]
         
         print(f"Checking for files in the last 4 hours: {folder_paths}")
         
         # Get all files from the last 4 hours
         gcs_bucket = storage_client.bucket(os.environ['GCS_BUCKET_NAME'])
         
-        # List blobs from each hour and combine
         all_blobs = []
-        for folder_path in folder_paths:
-            print(f"Listing files in folder: {folder_path}")
-            hour_blobs = list(gcs_bucket.list_blobs(prefix=folder_path))
-            hour_zip_blobs = [blob for blob in hour_blobs if blob.name.endswith('.zip')]
-            print(f"Found {len(hour_zip_blobs)} zip files in {folder_path}")
-            all_blobs.extend(hour_zip_blobs)
+        dispatch_only = False
+        if sqs_messages is not None:
+            # Queued messages name each file and its size, so skip listing and
+            # metadata lookups entirely; malformed messages are reported back
+            all_blobs, message_names, bad_message_ids = get_queued_blobs(gcs_bucket, sqs_messages)
+            transfers = submit_transfers(all_blobs, destination_base_path)
+        elif event.get('blob_names'):
+            # The trigger already names the files, so skip listing entirely
+            all_blobs = get_named_zip_blobs(gcs_bucket, event['blob_names'])
+            transfers = submit_transfers(all_blobs, destination_base_path)
+        else:
+            # Hour folder names sort chronologically, even across days, so a
+            # single listing bounded by the oldest hour and the next hour
+            # covers all four. Transfers start for each page as soon as it
+            # arrives so listing overlaps downloads; with a transfer queue
+            # the files are handed to workers instead
+            dispatch_only = bool(TRANSFER_QUEUE_URL)
+            on_page = None
+            if not dispatch_only:
+                on_page = lambda page_blobs: transfers.extend(
+                    submit_transfers(page_blobs, destination_base_path)
+                )
+            all_blobs = list_zip_blobs(
+                gcs_bucket, folder_paths[-1], get_hour_path(-1, now), on_page
+            )
         
         print(f"Found {len(all_blobs)} files to process from the last 4 hours")
         
@@ -196,77 +483,155 @@ def lambda_handler(event, context):
             print("No files found to process")
             
             # Record metric for no files found
-            put_metrics(cloudwatch, 'MOD/FileTransfer', [{
+            put_metrics('MOD/FileTransfer', [{
                 'MetricName': 'NoFilesFound',
                 'Value': 1,
                 'Unit': 'Count'
             }])
             
-            return {
+            response = {
                 'statusCode': 200,
                 'body': json.dumps({
                     'message': 'No files to process',
                     'checked_folders': folder_paths
                 })
             }
+            if sqs_messages is not None:
+                response['batchItemFailures'] = [
+                    {'itemIdentifier': message_id} for message_id in bad_message_ids
+                ]
+            return response
         
         total_size = sum(blob.size for blob in all_blobs)
         print(f"Total size of all files: {total_size} bytes")
         
-        # Process files one by one
-        results = []
-        for blob in all_blobs:
-            # Create destination path that preserves folder structure
-            destination_file_path = os.path.join(destination_base_path, blob.name)
-            result = transfer_single_file(blob, destination_file_path, cloudwatch)
-            results.append(result)
+        if dispatch_only:
+            # Most files in the overlapping hours were transferred or queued by
+            # earlier runs, so only queue the rest
+            pending = _POOL.map(lambda blob: needs_queueing(blob, destination_base_path), all_blobs)
+            pending_blobs = [blob for blob, is_pending in zip(all_blobs, pending) if is_pending]
+            skipped_files = len(all_blobs) - len(pending_blobs)
+            
+            # Mark files before queueing them so a fast worker always finds
+            # its marker to clear, then unmark the ones that failed to queue
+            marker_paths = {
+                blob.name: get_queued_marker_path(destination_base_path, blob.name)
+                for blob in pending_blobs
+            }
+            make_dirs(marker_paths.values())
+            list(_POOL.map(mark_queued, marker_paths.values()))
+            queued_names = {blob.name for blob in queue_transfers(pending_blobs)}
+            list(_POOL.map(clear_queued_marker, [
+                path for name, path in marker_paths.items() if name not in queued_names
+            ]))
+            print(f"Queued {len(queued_names)} files for transfer")
+            
+            batch_duration = time.time() - batch_start_time
+            track_batch_processing(
+                len(all_blobs),
+                0,
+                total_size,
+                batch_duration,
+                skipped_files,
+                len(queued_names)
+            )
+            
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'Files queued for transfer',
+                    'total_files': len(all_blobs),
+                    'queued_files': len(queued_names),
+                    'skipped_files': skipped_files,
+                    'failed_to_queue': len(pending_blobs) - len(queued_names),
+                    'checked_folders': folder_paths,
+                    'total_size': total_size,
+                    'duration_seconds': batch_duration
+                })
+            }
+        
+        # Wait for all transfers to finish
+        results = [transfer.result() for transfer in transfers]
+        flush_file_metrics()
         
-        successful_files = sum(1 for r in results if r)
+        successful_files = results.count(TRANSFERRED)
+        skipped_files = results.count(SKIPPED)
+        failed_files = results.count(FAILED)
         
         # Track batch metrics
         batch_duration = time.time() - batch_start_time
         track_batch_processing(
-            cloudwatch,
             len(all_blobs),
             successful_files,
             total_size,
-            batch_duration
+            batch_duration,
+            skipped_files
         )
         
-        return {
+        response = {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Processing complete',
                 'total_files': len(all_blobs),
                 'transferred_files': successful_files,
-                'failed_transfers': len(all_blobs) - successful_files,
+                'skipped_files': skipped_files,
+                'failed_transfers': failed_files,
                 'checked_folders': folder_paths,
                 'total_size': total_size,
                 'duration_seconds': batch_duration
             })
         }
         
+        if sqs_messages is not None:
+            # Files that arrived no longer need their queued markers; failed
+            # ones keep theirs while SQS redelivers the message
+            list(_POOL.map(clear_queued_marker, [
+                get_queued_marker_path(destination_base_path, blob.name)
+                for blob, result in zip(all_blobs, results) if result != FAILED
+            ]))
+            
+            # Only malformed messages and failed transfers go back on the queue
+            failed_names = {blob.name for blob, result in zip(all_blobs, results) if result == FAILED}
+            failed_message_ids = bad_message_ids + [
+                message_id for message_id, name in message_names.items()
+                if name in failed_names
+            ]
+            response['batchItemFailures'] = [
+                {'itemIdentifier': message_id} for message_id in failed_message_ids
+            ]
+        
+        return response
+        
     except Exception as e:
         print(f"Lambda execution failed: {str(e)}")
         import traceback
         print(traceback.format_exc())
         
+        # Transfers may already be running from earlier listing pages; stop
+        # the queued ones and let the rest finish so none outlive this run
+        for transfer in transfers:
+            transfer.cancel()
+        wait(transfers)
+        flush_file_metrics()
+        
         # Track metrics even in case of failure
-        if 'cloudwatch' in locals():
-            put_metrics(cloudwatch, 'MOD/FileTransfer', [{
-                'MetricName': 'LambdaFailure',
-                'Value': 1,
-                'Unit': 'Count'
-            }])
-            
-            if 'all_blobs' in locals():
-                track_batch_processing(
-                    cloudwatch,
-                    len(all_blobs),
-                    0,  # No successful files in case of failure
-                    0,  # Don't report size in case of failure
-                    time.time() - batch_start_time
-                )
+        put_metrics('MOD/FileTransfer', [{
+            'MetricName': 'LambdaFailure',
+            'Value': 1,
+            'Unit': 'Count'
+        }])
+        
+        if 'all_blobs' in locals():
+            track_batch_processing(
+                len(all_blobs),
+                0,  # No successful files in case of failure
+                0,  # Don't report size in case of failure
+                time.time() - batch_start_time
+            )
+        
+        # Fail the invocation so SQS redelivers the whole batch
+        if sqs_messages is not None:
+            raise
             
         return {
             'statusCode': 500,
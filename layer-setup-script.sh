@@ -11,7 +11,6 @@ echo "Creating requirements.txt..."
 cat > requirements.txt << EOL
 google-cloud-storage==2.12.0
 google-auth==2.23.0
-tenacity==8.2.3
 EOL
 
 # Install packages
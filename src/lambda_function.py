@@ -1,33 +1,103 @@
 import os
+import sys
 import json
 import boto3
-import uuid
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 import time
-import shutil
 from datetime import datetime, timezone
 from google.cloud import storage
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
 import io
 import zipfile
-import csv
 import re
 from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
-from tenacity import retry, stop_after_attempt, wait_exponential
+
+# Files are processed by one pool of workers while another archives raw zips,
+# and each S3 upload sends up to UPLOAD_PART_CONCURRENCY parts at once
+PROCESSING_CONCURRENCY = 16
+UPLOAD_PART_CONCURRENCY = 4
+
+# Clients are created once per container and reused across warm invocations,
+# keeping their connections alive between calls; the pool has room for every
+# upload part both worker pools can have in flight
+_BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    max_pool_connections=2 * PROCESSING_CONCURRENCY * UPLOAD_PART_CONCURRENCY
+)
+_S3 = boto3.client('s3', config=_BOTO_CONFIG)
+_SECRETS = boto3.client('secretsmanager', config=_BOTO_CONFIG)
+_STORAGE_CLIENT = None
+_STORAGE_CLIENT_EXPIRES = 0.0
+
+# Refresh the cached secret periodically so rotated credentials are picked up
+STORAGE_CLIENT_TTL_SECONDS = 30 * 60
+
+# Only request the blob attributes the handler reads when listing
+LIST_BLOBS_FIELDS = "items(name,size),nextPageToken"
+
+# Let GCS return only zip files when listing
+ZIP_MATCH_GLOB = "**/*.zip"
+
+# Large zips are uploaded to S3 as concurrent multipart chunks
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=UPLOAD_PART_CONCURRENCY,
+    use_threads=True
+)
+
+# Worker pools are reused across warm invocations; raw archive uploads get
+# their own pool so they overlap with validation without starving file workers
+_POOL = ThreadPoolExecutor(max_workers=PROCESSING_CONCURRENCY)
+_ARCHIVE_POOL = ThreadPoolExecutor(max_workers=PROCESSING_CONCURRENCY)
+
+# Downloads are attempted this many times, waiting 4-10 seconds in between
+DOWNLOAD_ATTEMPTS = 3
+
+# Per-file metrics are queued here and sent by flush_file_metrics
+_PENDING_FILE_METRICS = []
+
+# Metrics are written to stdout in CloudWatch Embedded Metric Format, which
+# allows at most 100 values per metric in one record
+EMF_MAX_VALUES = 100
+
+# Patterns for meteorological data, compiled once per container; groups are
+# non-capturing since only the match result is used
+HEADER_PATTERN = re.compile(r"^(?:time,)?lat,lon(?:,(?:air_pressure|air_temperature|rel_humidity|wind_direction|wind_speed)_[0-9]{0,10}){0,200}(?:,(?:cloud_cover|cloud_base|visibility|precipitation)){0,4}$")
+DATA_PATTERN = re.compile(r"^(?:[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2})?,?-?[0-9]{1,5}\.[0-9]{0,20},-?[0-9]{1,5}\.[0-9]{0,20}(?:,-?[0-9]{1,5}\.[0-9]{0,20})*$")
 
 def get_current_path():
     """Get current UTC time folder path: yyyy/MM/DD/HH"""
     now = datetime.now(timezone.utc)
     return now.strftime("%Y/%m/%d/%H")
 
-def setup_google_auth():
-    """Setup Google Cloud Auth using secret from AWS Secrets Manager"""
+def get_storage_client():
+    """Get the cached Google Cloud Storage client, rebuilding it once the cache expires"""
+    global _STORAGE_CLIENT, _STORAGE_CLIENT_EXPIRES
+    if _STORAGE_CLIENT is not None and time.monotonic() < _STORAGE_CLIENT_EXPIRES:
+        return _STORAGE_CLIENT
+
     try:
         credentials_dict = json.loads(
-            boto3.client('secretsmanager').get_secret_value(
+            _SECRETS.get_secret_value(
                 SecretId=os.environ['GOOGLE_CREDS_SECRET_NAME']
             )['SecretString']
         )
-        return storage.Credentials.from_service_account_info(credentials_dict)
+        credentials = service_account.Credentials.from_service_account_info(credentials_dict)
+        client = storage.Client(
+            project=credentials_dict.get('project_id'),
+            credentials=credentials
+        )
+        # The default pool keeps 10 connections; give every worker its own
+        adapter = HTTPAdapter(pool_connections=PROCESSING_CONCURRENCY, pool_maxsize=PROCESSING_CONCURRENCY)
+        client._http.mount('https://', adapter)
+        _STORAGE_CLIENT = client
+        _STORAGE_CLIENT_EXPIRES = time.monotonic() + STORAGE_CLIENT_TTL_SECONDS
+        return _STORAGE_CLIENT
     except Exception as e:
         print(f"Error setting up Google auth: {str(e)}")
         raise
@@ -39,10 +109,6 @@ def validate_csv_content(csv_content: str) -> Dict[str, Any]:
         "errors": []
     }
 
-    # Define patterns for meteorological data
-    HEADER_PATTERN = r"^(time,)?lat,lon(,(air_pressure|air_temperature|rel_humidity|wind_direction|wind_speed)_[0-9]{0,10}){0,200}(,(cloud_cover|cloud_base|visibility|precipitation)){0,4}$"
-    DATA_PATTERN = r"^([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2})?,?(-?[0-9]{1,5}\.[0-9]{0,20}),(-?[0-9]{1,5}\.[0-9]{0,20})((,-?[0-9]{1,5}\.[0-9]{0,20})*)$"
-
     try:
         # Split content into lines
         lines = [line.strip() for line in csv_content.split('\n') if line.strip()]
@@ -52,14 +118,14 @@ def validate_csv_content(csv_content: str) -> Dict[str, Any]:
 
         # Validate header
         header = lines[0]
-        if not re.match(HEADER_PATTERN, header):
+        if not HEADER_PATTERN.match(header):
             validation_result["errors"].append("InvalidHeader: Header format does not match expected pattern")
             return validation_result
 
         # Validate first and last row
         rows_to_check = [lines[1], lines[-1]] if len(lines) > 2 else lines[1:]
         for i, row in enumerate(rows_to_check):
-            if not re.match(DATA_PATTERN, row):
+            if not DATA_PATTERN.match(row):
                 validation_result["errors"].append(f"InvalidData: Row format does not match expected pattern")
                 return validation_result
 
@@ -70,28 +136,63 @@ def validate_csv_content(csv_content: str) -> Dict[str, Any]:
         validation_result["errors"].append(f"ValidationError: {str(e)}")
         return validation_result
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    reraise=True
-)
+def get_named_zip_blobs(gcs_bucket, blob_names):
+    """Fetch the zip files named in the triggering event, skipping missing ones"""
+    zip_names = [name for name in blob_names if name.endswith('.zip')]
+    return [blob for blob in _POOL.map(gcs_bucket.get_blob, zip_names) if blob is not None]
+
 def download_from_gcs_with_retry(blob):
     """Download from Google Cloud Storage with retry mechanism"""
-    try:
-        return blob.download_as_bytes()
-    except Exception as e:
-        print(f"Download attempt failed: {str(e)}")
-        raise
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        try:
+            return blob.download_as_bytes(raw_download=True, checksum=None)
+        except Exception as e:
+            print(f"Download attempt failed: {str(e)}")
+            if attempt == DOWNLOAD_ATTEMPTS:
+                raise
+
+        # Exponential backoff between attempts, bounded to 4-10 seconds
+        time.sleep(min(10, max(4, 2 ** (attempt - 1))))
 
-def put_metrics(cloudwatch, namespace: str, metrics_data: List[Dict]):
-    """Helper function to send metrics to CloudWatch"""
+def put_metrics(namespace: str, metrics_data: List[Dict]):
+    """Helper function to emit metrics to CloudWatch as Embedded Metric Format logs"""
     try:
-        cloudwatch.put_metric_data(Namespace=namespace, MetricData=metrics_data)
+        # Metrics sharing a dimension set go into the same EMF record
+        groups = {}
+        for metric in metrics_data:
+            dimensions = tuple((d['Name'], d['Value']) for d in metric.get('Dimensions', []))
+            units, values = groups.setdefault(dimensions, ({}, {}))
+            units[metric['MetricName']] = metric['Unit']
+            values.setdefault(metric['MetricName'], []).append(metric['Value'])
+
+        timestamp = int(time.time() * 1000)
+        for dimensions, (units, values) in groups.items():
+            longest = max(len(v) for v in values.values())
+            for start in range(0, longest, EMF_MAX_VALUES):
+                chunk = {
+                    name: v[start:start + EMF_MAX_VALUES]
+                    for name, v in values.items() if len(v) > start
+                }
+                record = {
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': namespace,
+                            'Dimensions': [[name for name, _ in dimensions]],
+                            'Metrics': [{'Name': name, 'Unit': units[name]} for name in chunk]
+                        }]
+                    }
+                }
+                record.update(dimensions)
+                record.update({name: v[0] if len(v) == 1 else v for name, v in chunk.items()})
+                # One write per record; print() writes the newline separately,
+                # so other threads' output could split the line
+                sys.stdout.write(json.dumps(record) + '\n')
     except Exception as e:
         print(f"Error sending metrics: {str(e)}")
 
-def track_file_processing(cloudwatch, file_name: str, file_size: int, duration: float, is_valid: bool, errors: List[str]):
-    """Track metrics for single file processing"""
+def track_file_processing(file_name: str, file_size: int, duration: float, is_valid: bool, errors: List[str]):
+    """Queue metrics for single file processing"""
     metrics = [
         {
             'MetricName': 'ProcessingDuration',
@@ -115,9 +216,16 @@ def track_file_processing(cloudwatch, file_name: str, file_size: int, duration:
             'Dimensions': [{'Name': 'FileName', 'Value': file_name}]
         })
 
-    put_metrics(cloudwatch, 'MOD/FileProcessing', metrics)
+    _PENDING_FILE_METRICS.extend(metrics)
+
+def flush_file_metrics():
+    """Send queued per-file metrics to CloudWatch"""
+    global _PENDING_FILE_METRICS
+    metrics, _PENDING_FILE_METRICS = _PENDING_FILE_METRICS, []
+    if metrics:
+        put_metrics('MOD/FileProcessing', metrics)
 
-def track_batch_processing(cloudwatch, total_files: int, successful_files: int, total_size: int, duration: float):
+def track_batch_processing(total_files: int, successful_files: int, total_size: int, duration: float):
     """Track metrics for batch processing"""
     metrics = [
         {
@@ -149,121 +257,123 @@ def track_batch_processing(cloudwatch, total_files: int, successful_files: int,
             'Unit': 'Percent'
         })
 
-    put_metrics(cloudwatch, 'MOD/BatchProcessing', metrics)
+    put_metrics('MOD/BatchProcessing', metrics)
 
-def process_single_file(blob, s3_client, cloudwatch):
-    """Process a single zip file with cleanup and metrics"""
+def process_single_file(blob, s3_client, current_path):
+    """Process a single zip file with metrics"""
     start_time = time.time()
-    temp_dir = os.path.join('/tmp', str(uuid.uuid4()))
-    os.makedirs(temp_dir, exist_ok=True)
+    raw_upload = None
     
     try:
         # Download zip from Google Cloud Storage
         zip_content = download_from_gcs_with_retry(blob)
         
-        # Upload to raw folder in untrusted S3
-        raw_key = f"raw/{get_current_path()}/{blob.name}"
-        s3_client.put_object(
-            Bucket=os.environ['S3_BUCKET_NAME'],
-            Key=raw_key,
-            Body=zip_content
+        # Upload to raw folder in untrusted S3 while the CSV is validated
+        raw_upload = _ARCHIVE_POOL.submit(
+            s3_client.upload_fileobj,
+            io.BytesIO(zip_content),
+            os.environ['S3_BUCKET_NAME'],
+            f"raw/{current_path}/{blob.name}",
+            Config=TRANSFER_CONFIG
         )
 
-        # Extract and validate CSV
-        temp_zip_path = os.path.join(temp_dir, 'temp.zip')
-        with open(temp_zip_path, 'wb') as f:
-            f.write(zip_content)
-        
-        with zipfile.ZipFile(temp_zip_path) as zip_ref:
+        # Extract and validate CSV in memory
+        with zipfile.ZipFile(io.BytesIO(zip_content)) as zip_ref:
             csv_filename = zip_ref.namelist()[0]  # Should be only one CSV
-            temp_csv_path = os.path.join(temp_dir, csv_filename)
-            zip_ref.extract(csv_filename, temp_dir)
-            
-            with open(temp_csv_path, 'r') as f:
-                csv_content = f.read()
-            
-            # Validate CSV content
-            validation_result = validate_csv_content(csv_content)
-            
-            # Track file metrics
-            process_duration = time.time() - start_time
-            track_file_processing(
-                cloudwatch,
-                blob.name,
-                blob.size,
-                process_duration,
-                validation_result["is_valid"],
-                validation_result["errors"]
-            )
+            csv_content = zip_ref.read(csv_filename).decode('utf-8')
             
-            if validation_result["is_valid"]:
-                # If valid, copy to trusted S3 bucket
-                s3_client.copy_object(
-                    Bucket=os.environ['TRUSTED_S3_BUCKET'],
-                    Key=f"valid/{get_current_path()}/{blob.name}",
-                    CopySource={'Bucket': os.environ['S3_BUCKET_NAME'], 'Key': raw_key},
-                    Metadata={
+        # Validate CSV content
+        validation_result = validate_csv_content(csv_content)
+        
+        # Track file metrics
+        process_duration = time.time() - start_time
+        track_file_processing(
+            blob.name,
+            blob.size,
+            process_duration,
+            validation_result["is_valid"],
+            validation_result["errors"]
+        )
+        
+        # The raw copy must be archived before the file is published anywhere;
+        # the failure itself is reported below
+        if raw_upload.exception() is not None:
+            return False
+        
+        if validation_result["is_valid"]:
+            # If valid, upload straight to trusted S3 bucket
+            s3_client.upload_fileobj(
+                io.BytesIO(zip_content),
+                os.environ['TRUSTED_S3_BUCKET'],
+                f"valid/{current_path}/{blob.name}",
+                ExtraArgs={
+                    'Metadata': {
                         'validation_status': 'valid',
                         'process_duration': str(process_duration)
-                    },
-                    MetadataDirective='REPLACE'
-                )
-                return True
-            else:
-                # Create error log
-                s3_client.put_object(
-                    Bucket=os.environ['S3_BUCKET_NAME'],
-                    Key=f"invalid/{get_current_path()}/{blob.name}.errors.json",
-                    Body=json.dumps({
-                        'validation_result': validation_result,
-                        'process_duration': process_duration
-                    }, indent=2),
-                    Metadata={'validation_status': 'invalid'}
-                )
-                return False
+                    }
+                },
+                Config=TRANSFER_CONFIG
+            )
+        else:
+            # Create error log
+            s3_client.put_object(
+                Bucket=os.environ['S3_BUCKET_NAME'],
+                Key=f"invalid/{current_path}/{blob.name}.errors.json",
+                Body=json.dumps({
+                    'validation_result': validation_result,
+                    'process_duration': process_duration
+                }, indent=2),
+                Metadata={'validation_status': 'invalid'}
+            )
+
+        return validation_result["is_valid"]
 
     except Exception as e:
         print(f"Error processing file {blob.name}: {str(e)}")
         return False
         
     finally:
-        # Clean up temporary files
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        # Wait for the archive upload even when processing failed, so its
+        # failure is reported rather than lost
+        if raw_upload is not None and raw_upload.exception() is not None:
+            print(f"Error archiving raw file {blob.name}: {str(raw_upload.exception())}")
 
 def lambda_handler(event, context):
     """Main Lambda handler"""
     batch_start_time = time.time()
     
     try:
-        # Initialize clients
-        s3_client = boto3.client('s3')
-        cloudwatch = boto3.client('cloudwatch')
-        storage_client = storage.Client(credentials=setup_google_auth())
+        storage_client = get_storage_client()
         
-        # Get current folder path
+        # Get current folder path once; it also prefixes every S3 key written
         folder_path = get_current_path()
         
-        # Get all zip files from current hour
         gcs_bucket = storage_client.bucket(os.environ['GCS_BUCKET_NAME'])
-        blobs = [blob for blob in gcs_bucket.list_blobs(prefix=folder_path) 
-                if blob.name.endswith('.zip')]
+        if event.get('blob_names'):
+            # The trigger already names the files, so skip listing entirely
+            blobs = get_named_zip_blobs(gcs_bucket, event['blob_names'])
+        else:
+            # Get all zip files from current hour
+            blobs = list(gcs_bucket.list_blobs(
+                prefix=folder_path,
+                match_glob=ZIP_MATCH_GLOB,
+                fields=LIST_BLOBS_FIELDS
+            ))
         
         total_size = sum(blob.size for blob in blobs)
         
         # Process files concurrently
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            results = list(executor.map(
-                lambda blob: process_single_file(blob, s3_client, cloudwatch), 
-                blobs
-            ))
+        results = list(_POOL.map(
+            lambda blob: process_single_file(blob, _S3, folder_path),
+            blobs
+        ))
+        flush_file_metrics()
         
         successful_files = sum(1 for r in results if r)
         
         # Track batch metrics
         batch_duration = time.time() - batch_start_time
         track_batch_processing(
-            cloudwatch,
             len(blobs),
             successful_files,
             total_size,
@@ -285,10 +395,10 @@ def lambda_handler(event, context):
         
     except Exception as e:
         print(f"Lambda execution failed: {str(e)}")
+        flush_file_metrics()
         # Track metrics even in case of failure
-        if 'cloudwatch' in locals() and 'blobs' in locals():
+        if 'blobs' in locals():
             track_batch_processing(
-                cloudwatch,
                 len(blobs),
                 0,  # No successful files in case of failure
                 0,  # Don't report size in case of failure